@@ -36,7 +36,7 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-logger.info(f"Логирование запущено. Логи будут сохраняться в: {log_filepath}")
+logger.info("Логирование запущено. Логи будут сохраняться в: %s", log_filepath)
 
 # Загружаем переменные окружения
 load_dotenv()
@@ -65,14 +65,14 @@ bot = telebot.TeleBot(TELEGRAM_TOKEN)
 @bot.message_handler(commands=['start'])
 def start(message):
     """Обработчик команды /start"""
-    logger.info(f"Пользователь {message.from_user.id} начал разговор с ботом")
+    logger.info("Пользователь %s начал разговор с ботом", message.from_user.id)
     start_handler(message, bot)
 
 
 @bot.message_handler(content_types=['contact'])
 def phone(message):
     """Обработчик получения контакта"""
-    logger.info(f"Получен контакт от пользователя {message.from_user.id}")
+    logger.info("Получен контакт от пользователя %s", message.from_user.id)
     phone_handler(message, bot)
 
 
@@ -117,7 +117,7 @@ def main():
     except KeyboardInterrupt:
         logger.info("🛑 Получен сигнал остановки (Ctrl+C)")
     except Exception as e:
-        logger.error(f"❌ Критическая ошибка: {e}", exc_info=True)
+        logger.error("❌ Критическая ошибка: %s", e, exc_info=True)
     finally:
         logger.info("👋 Бот остановлен")
 
@@ -53,7 +53,7 @@ def phone_handler(message, bot):
         bot: Экземпляр бота
     """
     if not message.contact:
-        logger.warning(f"Пользователь {message.from_user.id} отправил сообщение без контакта")
+        logger.warning("Пользователь %s отправил сообщение без контакта", message.from_user.id)
         bot.send_message(
             message.chat.id,
             "⚠️ Пожалуйста, используйте кнопку для отправки контакта."
@@ -82,7 +82,7 @@ def phone_handler(message, bot):
 
     # Сравниваем нормализованные номера
     if normalized_user_phone == normalized_allowed_phone:
-        logger.info(f"Пользователь {user_id} успешно авторизован ✅")
+        logger.info("Пользователь %s успешно авторизован ✅", user_id)
 
         # Удаляем клавиатуру с кнопкой "Поделиться контактами"
         bot.send_message(
@@ -111,7 +111,7 @@ def phone_handler(message, bot):
         try:
             handle_stock_callback(fake_call, bot)
         except Exception as e:
-            logger.error(f"Ошибка при открытии портфеля после авторизации: {e}")
+            logger.error("Ошибка при открытии портфеля после авторизации: %s", e)
             bot.send_message(
                 message.chat.id,
                 "Добро пожаловать! Используйте команду /start для начала работы."
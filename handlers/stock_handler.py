@@ -6,13 +6,19 @@ from utils.api_client import (
     get_portfolio_positions,
     get_share_info,
     get_last_prices,
-    get_withdraw_limits,
+    fetch_dashboard,
     format_quotation,
+    get_price_map,
     get_candles,
     get_portfolio_history,
-    get_portfolio_value_yesterday
+    parse_timestamp
+)
+from utils.chart_generator import (
+    generate_balance_chart,
+    generate_stock_chart,
+    format_price_with_precision,
+    get_currency_symbol
 )
-from utils.chart_generator import generate_balance_chart, generate_stock_chart, format_price_with_precision
 
 logger = logging.getLogger(__name__)
 
@@ -28,16 +34,7 @@ def format_money(value: float, currency: str = "RUB") -> str:
     Returns:
         str: Отформатированная строка
     """
-    currency_symbols = {
-        "RUB": "₽",
-        "USD": "$",
-        "EUR": "€",
-        "rub": "₽",
-        "usd": "$",
-        "eur": "€"
-    }
-
-    symbol = currency_symbols.get(currency, currency)
+    symbol = get_currency_symbol(currency)
     return f"{value:,.2f} {symbol}".replace(",", " ")
 
 
@@ -88,14 +85,14 @@ def calculate_position_growth(position: Dict, current_price: float) -> Tuple[flo
 
 def create_portfolio_keyboard(
         positions: List[Dict],
-        prices_data: Dict = None
+        price_map: Dict[str, float] = None
 ) -> telebot.types.InlineKeyboardMarkup:
     """
     Создаёт клавиатуру с акциями из портфеля.
 
     Args:
         positions: Список позиций из портфеля
-        prices_data: Данные о текущих ценах акций
+        price_map: Текущие цены акций по FIGI (см. get_price_map)
 
     Returns:
         InlineKeyboardMarkup: Клавиатура с кнопками
@@ -109,13 +106,7 @@ def create_portfolio_keyboard(
     )
     markup.add(dynamics_button)
 
-    # Получаем цены
-    price_map = {}
-    if prices_data and "last_prices" in prices_data:
-        for price_item in prices_data["last_prices"]:
-            figi = price_item.get("figi")
-            price = format_quotation(price_item.get("price", {}))
-            price_map[figi] = price
+    price_map = price_map or {}
 
     buttons = []
     for position in positions:
@@ -147,7 +138,7 @@ def create_portfolio_keyboard(
                     sign = ""
 
                 currency = position.get("currency", "RUB")
-                currency_symbol = "₽" if currency == "RUB" else currency
+                currency_symbol = get_currency_symbol(currency)
 
                 button_text = (
                     f"{emoji} {prefix}{ticker} "
@@ -163,7 +154,7 @@ def create_portfolio_keyboard(
             )
             buttons.append(button)
         except Exception as e:
-            logger.error(f"Ошибка при создании кнопки для позиции: {e}")
+            logger.error("Ошибка при создании кнопки для позиции: %s", e)
             continue
 
     # Добавляем кнопки с акциями по 2 в ряд
@@ -184,13 +175,13 @@ def stock_handler(call, bot):
 
     # Обработка запроса портфеля
     if call.data == "view_stocks":
-        logger.info(f"Пользователь {call.from_user.id} запросил свой портфель 📊")
+        logger.info("Пользователь %s запросил свой портфель 📊", call.from_user.id)
 
         # Удаляем предыдущее сообщение
         try:
             bot.delete_message(call.message.chat.id, call.message.message_id)
         except Exception as e:
-            logger.warning(f"Не удалось удалить сообщение: {e}")
+            logger.warning("Не удалось удалить сообщение: %s", e)
 
         # Получаем позиции из портфеля
         positions, portfolio, account_id = get_portfolio_positions()
@@ -209,8 +200,12 @@ def stock_handler(call, bot):
             )
             return
 
+        # Лимиты, текущие цены и стоимость портфеля на вчера загружаем параллельно
+        figis = [pos.get("figi") for pos in positions if pos.get("figi")]
+        dashboard = fetch_dashboard(account_id, figis) if account_id else {}
+
         # Получаем данные по балансам
-        limits = get_withdraw_limits(account_id) if account_id else None
+        limits = dashboard.get("limits")
 
         def extract_money_value(values):
             if not values:
@@ -227,22 +222,14 @@ def stock_handler(call, bot):
         elif portfolio:
             current_balance = extract_money_value([portfolio.get("totalAmountCurrencies", {})])
 
-        # Получаем текущие цены для всех позиций
-        figis = [pos.get("figi") for pos in positions if pos.get("figi")]
-        prices_data = get_last_prices(figis) if figis else None
+        # Текущие цены для всех позиций
+        price_map = get_price_map(dashboard.get("prices"))
 
         # Рассчитываем сумму по всем акциям и прибыль
         stocks_value = 0.0
         total_buy_value = 0.0
         currency = "RUB"
 
-        price_map = {}
-        if prices_data and "last_prices" in prices_data:
-            for price_item in prices_data["last_prices"]:
-                figi = price_item.get("figi")
-                price = format_quotation(price_item.get("price", {}))
-                price_map[figi] = price
-
         for position in positions:
             figi = position.get("figi")
             quantity = format_quotation(position.get("quantity", {}))
@@ -269,7 +256,7 @@ def stock_handler(call, bot):
                     total_profit_absolute / portfolio_value_without_profit * 100) if portfolio_value_without_profit != 0 else 0
 
         # Прибыль за сегодня
-        yesterday_value = get_portfolio_value_yesterday(account_id) if account_id else None
+        yesterday_value = dashboard.get("yesterday_value")
 
         if yesterday_value is not None and yesterday_value > 0:
             today_profit_absolute = portfolio_value - yesterday_value
@@ -284,7 +271,7 @@ def stock_handler(call, bot):
             logger.warning("Не удалось рассчитать изменение за сегодня - используем нулевые значения")
 
         # Создаём клавиатуру с акциями из портфеля
-        markup = create_portfolio_keyboard(positions, prices_data)
+        markup = create_portfolio_keyboard(positions, price_map)
 
         message_lines = [f"💼 Ваш портфель ({len(positions)} позиций) 📈\n"]
 
@@ -321,7 +308,7 @@ def stock_handler(call, bot):
     # Обработка выбора конкретной акции из портфеля
     elif call.data.startswith("portfolio_select::"):
         figi = call.data.split("::")[1]
-        logger.info(f"Пользователь {call.from_user.id} выбрал акцию из портфеля FIGI={figi}")
+        logger.info("Пользователь %s выбрал акцию из портфеля FIGI=%s", call.from_user.id, figi)
 
         # Показываем индикатор загрузки
         bot.answer_callback_query(call.id, "⏳ Загружаю данные...")
@@ -330,7 +317,7 @@ def stock_handler(call, bot):
         try:
             bot.delete_message(call.message.chat.id, call.message.message_id)
         except Exception as e:
-            logger.warning(f"Не удалось удалить сообщение портфеля: {e}")
+            logger.warning("Не удалось удалить сообщение портфеля: %s", e)
 
         # Получаем позиции портфеля из кэша (использует кэш если доступен)
         positions, _, _ = get_portfolio_positions(use_cache=True)
@@ -359,14 +346,7 @@ def stock_handler(call, bot):
             return
 
         # Получаем последнюю цену
-        price_data = get_last_prices([figi])
-        current_price = 0.0
-
-        if price_data and "last_prices" in price_data:
-            prices = price_data["last_prices"]
-            if prices and len(prices) > 0:
-                price_obj = prices[0].get("price", {})
-                current_price = format_quotation(price_obj)
+        current_price = get_price_map(get_last_prices([figi])).get(figi, 0.0)
 
         # Извлекаем данные из позиции
         ticker = share_info.get("ticker", "N/A")
@@ -458,7 +438,7 @@ def stock_handler(call, bot):
     # Обработка просмотра динамики баланса
     elif call.data.startswith("balance_dynamics::"):
         period = call.data.split("::")[1]
-        logger.info(f"Пользователь {call.from_user.id} запросил динамику баланса за период {period}")
+        logger.info("Пользователь %s запросил динамику баланса за период %s", call.from_user.id, period)
 
         # Показываем индикатор загрузки
         bot.answer_callback_query(call.id, "⏳ Загружаю данные...")
@@ -467,7 +447,7 @@ def stock_handler(call, bot):
         try:
             bot.delete_message(call.message.chat.id, call.message.message_id)
         except Exception as e:
-            logger.warning(f"Не удалось удалить сообщение: {e}")
+            logger.warning("Не удалось удалить сообщение: %s", e)
 
         # Определяем временной интервал
         now = datetime.utcnow()
@@ -543,7 +523,7 @@ def stock_handler(call, bot):
         figi = parts[1]
         period = parts[2] if len(parts) > 2 else "1w"
 
-        logger.info(f"Пользователь {call.from_user.id} запросил динамику акции {figi} за период {period}")
+        logger.info("Пользователь %s запросил динамику акции %s за период %s", call.from_user.id, figi, period)
 
         # Показываем индикатор загрузки
         bot.answer_callback_query(call.id, "⏳ Загружаю данные...")
@@ -552,7 +532,7 @@ def stock_handler(call, bot):
         try:
             bot.delete_message(call.message.chat.id, call.message.message_id)
         except Exception as e:
-            logger.warning(f"Не удалось удалить сообщение: {e}")
+            logger.warning("Не удалось удалить сообщение: %s", e)
 
         # Получаем информацию об акции
         share_info = get_share_info(figi)
@@ -586,13 +566,13 @@ def stock_handler(call, bot):
 
                 if timestamp_str and close_price > 0:
                     try:
-                        timestamp = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
+                        timestamp = parse_timestamp(timestamp_str)
                         history.append({
                             'timestamp': timestamp,
                             'price': close_price
                         })
                     except Exception as e:
-                        logger.warning(f"Не удалось преобразовать timestamp {timestamp_str}: {e}")
+                        logger.warning("Не удалось преобразовать timestamp %s: %s", timestamp_str, e)
                         continue
 
             if history:
@@ -690,7 +670,7 @@ def handle_stock_callback(call, bot):
     try:
         stock_handler(call, bot)
     except Exception as e:
-        logger.error(f"Ошибка в обработчике акций: {e}", exc_info=True)
+        logger.error("Ошибка в обработчике акций: %s", e, exc_info=True)
         bot.send_message(
             call.message.chat.id,
             "❌ Произошла ошибка при обработке запроса.\n"
@@ -1,13 +1,26 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
 import logging
 import time
 import threading
+from functools import lru_cache, wraps
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 from typing import List, Dict, Optional, Tuple
+import numpy as np
 from dotenv import load_dotenv
+from cachetools import TTLCache
+from cachetools.keys import hashkey
 import urllib3
 
+try:
+    # orjson разбирает байты ответа напрямую, без промежуточной строки
+    import orjson as json_codec
+except ImportError:
+    import json as json_codec
+
 # ⚠️ ВНИМАНИЕ: Это временное решение для тестирования!
 # Отключаем предупреждения о небезопасном SSL
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -27,6 +40,16 @@ BASE_URL = "https://invest-public-api.tbank.ru/rest"
 # URL песочницы
 SANDBOX_URL = "https://sandbox-invest-public-api.tbank.ru/rest"
 
+# URL методов API собираются один раз при импорте
+_API_PREFIX = f"{BASE_URL}/tinkoff.public.invest.api.contract.v1"
+_URL_GET_ACCOUNTS = f"{_API_PREFIX}.UsersService/GetAccounts"
+_URL_GET_PORTFOLIO = f"{_API_PREFIX}.OperationsService/GetPortfolio"
+_URL_GET_WITHDRAW_LIMITS = f"{_API_PREFIX}.OperationsService/GetWithdrawLimits"
+_URL_SHARES = f"{_API_PREFIX}.InstrumentsService/Shares"
+_URL_SHARE_BY = f"{_API_PREFIX}.InstrumentsService/ShareBy"
+_URL_GET_LAST_PRICES = f"{_API_PREFIX}.MarketDataService/GetLastPrices"
+_URL_GET_CANDLES = f"{_API_PREFIX}.MarketDataService/GetCandles"
+
 # ⚠️ ОТКЛЮЧАЕМ ПРОВЕРКУ SSL (только для тестирования!)
 SSL_VERIFY = False
 
@@ -35,14 +58,65 @@ logger.warning(
     "Это небезопасно для продакшена. Используйте только для тестирования."
 )
 
-# Глобальная сессия для переиспользования TCP-соединений
-_session = None
-_session_lock = threading.Lock()
+# Размер пула keep-alive соединений с API. HTTP/1.1 допускает только один
+# запрос на соединение, поэтому пул должен покрывать все параллельные запросы,
+# иначе лишние соединения закрываются и каждый раз заново проходят TCP/TLS
+HTTP_POOL_SIZE = 32
+
+# Максимальное число параллельных запросов к API из одного вызова.
+# Не должно превышать HTTP_POOL_SIZE, иначе соединения не поместятся в пул
+MAX_PARALLEL_REQUESTS = 16
+
+# Повторы запросов при сетевых сбоях, превышении лимита (429) и ошибках сервера.
+# Все используемые методы API только читают данные, поэтому POST можно повторять
+HTTP_RETRY = Retry(
+    total=3,
+    backoff_factor=0.2,
+    status_forcelist=[429, 500, 502, 503, 504],
+    allowed_methods=["POST"]
+)
+
+# Значение instrumentType для акций в ответах API
+INSTRUMENT_TYPE_SHARE = "share"
+
+# Глубина поиска последней дневной свечи при оценке стоимости портфеля (дней)
+PORTFOLIO_VALUE_LOOKBACK_DAYS = 7
 
 # Кэш для данных с TTL
-_cache = {}
 _cache_lock = threading.Lock()
 _cache_ttl = 30  # секунд
+# Сколько секунд после истечения TTL ещё можно отдавать устаревшие данные,
+# пока в фоне загружаются свежие (stale-while-revalidate)
+_cache_stale_ttl = 60  # секунд
+# Кэш портфелей ограничен по размеру; запись живёт весь срок, пока её ещё
+# можно отдавать как устаревшую, после чего TTLCache удаляет её сам
+_cache = TTLCache(maxsize=128, ttl=_cache_ttl + _cache_stale_ttl)
+# Список счетов меняется редко, поэтому хранится дольше портфеля
+_accounts_cache_ttl = 300  # секунд
+# Справочные данные об акциях почти не меняются в течение дня. Список акций
+# после истечения TTL перезапрашивается условно (по ETag)
+_shares_cache_ttl = 300  # секунд
+_share_info_cache_ttl = 3600  # секунд
+# Ключи кэша, для которых уже идёт фоновое обновление
+_refreshing_keys = set()
+# Блокировки отдельных ключей кэша, чтобы при промахе портфель
+# загружал только один поток (защита от лавины одинаковых запросов)
+_key_locks = {}
+
+# TTL-кэши функций, обёрнутых в _ttl_cached, с их блокировками
+# (очищаются вместе с _cache)
+_ttl_caches = []
+
+# Глобальная HTTP-сессия, создаётся при первом обращении
+_session = None
+_session_lock = threading.Lock()
+
+# ETag и разобранные ответы для условных запросов (см. _post_json):
+# (url, сериализованное тело) -> (etag, ответ). Условных запросов немного,
+# а ответы большие, поэтому кэш ограничен по размеру и времени жизни;
+# запись должна пережить TTL кэша самого ответа, иначе условный запрос бесполезен
+_etag_cache_ttl = 3600  # секунд
+_etag_cache = TTLCache(maxsize=16, ttl=_etag_cache_ttl)
 
 
 def get_session() -> requests.Session:
@@ -59,62 +133,204 @@ def get_session() -> requests.Session:
         with _session_lock:
             # Double-check locking pattern
             if _session is None:
-                _session = requests.Session()
-                _session.headers.update({
+                session = requests.Session()
+                session.headers.update({
                     "Authorization": f"Bearer {T_INVEST_API_KEY}",
-                    "Content-Type": "application/json"
+                    "Content-Type": "application/json",
+                    # Ответы со списками инструментов и свечей - многомегабайтный JSON,
+                    # в сжатом виде они в разы меньше; requests распаковывает их сам
+                    "Accept-Encoding": "gzip, deflate"
                 })
+                session.mount("https://", HTTPAdapter(pool_maxsize=HTTP_POOL_SIZE, max_retries=HTTP_RETRY))
+                # Сессия публикуется только полностью настроенной
+                _session = session
                 logger.info("Создана новая глобальная HTTP-сессия")
     return _session
 
 
 def clear_cache():
     """Очищает весь кэш. Thread-safe."""
-    global _cache
     with _cache_lock:
-        _cache = {}
-        logger.info("Кэш очищен")
+        _cache.clear()
+        _etag_cache.clear()
+    for cache, lock in _ttl_caches:
+        with lock:
+            cache.clear()
+    logger.info("Кэш очищен")
 
 
-def get_accounts() -> List[Dict]:
+def _ttl_cached(maxsize: int, ttl: float, key=hashkey):
     """
-    Получает список счетов пользователя.
+    Декоратор TTL-кэша для функций, только читающих данные из API.
+
+    Пустые результаты (None, []) не кэшируются, чтобы временная ошибка API
+    не запоминалась на весь TTL. Thread-safe: у каждого кэша своя
+    блокировка, поэтому обращения к разным функциям не конкурируют.
+
+    Args:
+        maxsize: Максимальное число записей в кэше
+        ttl: Время жизни записи в секундах
+        key: Функция построения ключа из аргументов вызова
 
     Returns:
-        List[Dict]: Список счетов
+        Callable: Декоратор
     """
-    url = f"{BASE_URL}/tinkoff.public.invest.api.contract.v1.UsersService/GetAccounts"
+    def decorator(func):
+        cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        lock = threading.Lock()
+        _ttl_caches.append((cache, lock))
 
-    body = {}
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            cache_key = key(*args, **kwargs)
+            with lock:
+                result = cache.get(cache_key)
+            if result is not None:
+                return result
 
-    session = get_session()
+            result = func(*args, **kwargs)
+            if result:
+                with lock:
+                    cache[cache_key] = result
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def _executor(workers: int) -> ThreadPoolExecutor:
+    """
+    Создаёт пул потоков для параллельных запросов к API.
+    Сессия создаётся до запуска потоков, чтобы они не ждали её создания на блокировке.
+
+    Args:
+        workers: Число потоков
+
+    Returns:
+        ThreadPoolExecutor: Пул потоков
+    """
+    get_session()
+    return ThreadPoolExecutor(max_workers=workers)
+
+
+def _post(url: str, data: bytes, timeout: float = 10, headers: Optional[Dict] = None) -> requests.Response:
+    """
+    Отправляет POST-запрос к API через общую сессию.
+
+    Args:
+        url: Полный URL метода API
+        data: Тело запроса, уже сериализованное в JSON
+        timeout: Таймаут запроса в секундах
+        headers: Дополнительные заголовки
+
+    Returns:
+        requests.Response: Ответ сервера
+    """
+    return get_session().post(
+        url,
+        data=data,
+        headers=headers,
+        timeout=timeout,
+        verify=SSL_VERIFY
+    )
+
+
+def _post_json(
+        url: str,
+        body: Dict,
+        error_message: str,
+        timeout: float = 10,
+        conditional: bool = False
+) -> Optional[Dict]:
+    """
+    Отправляет POST-запрос к API и разбирает JSON-ответ.
+    Тело сериализуется json_codec (orjson, если установлен).
+    Ошибки сети, HTTP-статусы ошибок и некорректный JSON логируются
+    с переданным сообщением, в этом случае возвращается None.
+
+    Args:
+        url: Полный URL метода API
+        body: Тело запроса
+        error_message: Текст ошибки для лога
+        timeout: Таймаут запроса в секундах
+        conditional: Условный запрос по ETag. Для больших и редко меняющихся
+            ответов сервер может ответить 304 (или 412) без тела, и тогда
+            возвращается ранее разобранный ответ на тот же запрос
+
+    Returns:
+        Optional[Dict]: Разобранный ответ или None в случае ошибки
+    """
+    data = json_codec.dumps(body)
+    etag_key = (url, data)
+
+    cached = None
+    headers = None
+    if conditional:
+        with _cache_lock:
+            cached = _etag_cache.get(etag_key)
+        if cached:
+            headers = {"If-None-Match": cached[0]}
 
     try:
-        logger.info("Запрос списка счетов пользователя")
+        response = _post(url, data, timeout=timeout, headers=headers)
+
+        # На условный POST сервер может ответить не 304, а 412 Precondition
+        # Failed (RFC 9110): это тоже значит, что ETag совпал
+        if cached and response.status_code in (304, 412):
+            logger.debug("Ответ не изменился, используются ранее полученные данные")
+            return cached[1]
+
+        # Статус проверяем сами: raise_for_status на каждом успешном ответе
+        # лишний раз собирает строку причины
+        if response.status_code >= 400:
+            logger.error("%s: HTTP %s %s", error_message, response.status_code, response.reason)
+            if cached:
+                # Устаревший ETag не должен ломать все следующие запросы
+                with _cache_lock:
+                    _etag_cache.pop(etag_key, None)
+            return None
 
-        response = session.post(
-            url,
-            json=body,
-            timeout=10,
-            verify=SSL_VERIFY
-        )
+        # Разбираем байты ответа напрямую, без промежуточной строки
+        result = json_codec.loads(response.content)
 
-        response.raise_for_status()
-        result = response.json()
+        if conditional:
+            etag = response.headers.get("ETag")
+            if etag:
+                with _cache_lock:
+                    _etag_cache[etag_key] = (etag, result)
 
-        accounts = result.get("accounts", [])
+        return result
+    except (requests.exceptions.RequestException, ValueError) as err:
+        logger.error("%s: %s", error_message, err)
+        return None
 
-        if not accounts:
-            logger.warning("У пользователя нет доступных счетов")
-            return []
 
-        logger.info(f"Получено {len(accounts)} счетов")
-        return accounts
+@_ttl_cached(maxsize=1, ttl=_accounts_cache_ttl)
+def get_accounts() -> List[Dict]:
+    """
+    Получает список счетов пользователя.
+
+    Returns:
+        List[Dict]: Список счетов
+    """
+    body = {}
 
-    except requests.exceptions.RequestException as err:
-        logger.error(f"Ошибка при запросе списка счетов: {err}")
+    logger.debug("Запрос списка счетов пользователя")
+
+    result = _post_json(_URL_GET_ACCOUNTS, body, "Ошибка при запросе списка счетов")
+    if result is None:
+        return []
+
+    accounts = result.get("accounts", [])
+
+    if not accounts:
+        logger.warning("У пользователя нет доступных счетов")
         return []
 
+    logger.info("Получено %s счетов", len(accounts))
+    return accounts
+
 
 def get_portfolio(account_id: str, currency: str = "RUB") -> Optional[Dict]:
     """
@@ -127,36 +343,21 @@ def get_portfolio(account_id: str, currency: str = "RUB") -> Optional[Dict]:
     Returns:
         Optional[Dict]: Данные портфеля или None
     """
-    url = f"{BASE_URL}/tinkoff.public.invest.api.contract.v1.OperationsService/GetPortfolio"
-
     body = {
         "accountId": account_id,
         "currency": currency
     }
 
-    session = get_session()
-
-    try:
-        logger.info(f"Запрос портфеля для счёта {account_id}")
+    logger.debug("Запрос портфеля для счёта %s", account_id)
 
-        response = session.post(
-            url,
-            json=body,
-            timeout=10,
-            verify=SSL_VERIFY
-        )
-
-        response.raise_for_status()
-        result = response.json()
+    result = _post_json(_URL_GET_PORTFOLIO, body, "Ошибка при запросе портфеля")
+    if result is None:
+        return None
 
-        positions = result.get("positions", [])
-        logger.info(f"В портфеле {len(positions)} позиций")
+    positions = result.get("positions", [])
+    logger.info("В портфеле %s позиций", len(positions))
 
-        return result
-
-    except requests.exceptions.RequestException as err:
-        logger.error(f"Ошибка при запросе портфеля: {err}")
-        return None
+    return result
 
 
 def get_portfolio_positions(account_id: str = None, use_cache: bool = True) -> Tuple[
@@ -168,7 +369,9 @@ def get_portfolio_positions(account_id: str = None, use_cache: bool = True) -> T
     Args:
         account_id: Идентификатор счёта (опционально)
         use_cache: Использовать ли кэш данных портфеля. По умолчанию True.
-            При True данные кэшируются на _cache_ttl секунд (30 сек).
+            При True данные кэшируются на _cache_ttl секунд (30 сек), а ещё
+            _cache_stale_ttl секунд после этого отдаются устаревшие данные,
+            пока в фоне загружаются свежие.
             При False всегда делается свежий запрос к API.
 
     Returns:
@@ -188,53 +391,145 @@ def get_portfolio_positions(account_id: str = None, use_cache: bool = True) -> T
             logger.error("Не удалось получить список счетов")
             return [], None, None
         account_id = accounts[0].get("id")
-        logger.info(f"Используется счёт: {account_id}")
+        logger.info("Используется счёт: %s", account_id)
+
+    # Ключ-кортеж не требует форматирования строки при каждом обращении к кэшу
+    cache_key = ("portfolio", account_id)
+
+    if not use_cache:
+        result = _load_portfolio_positions(account_id)
+        return result if result is not None else ([], None, account_id)
 
     # Проверяем кэш (thread-safe)
-    cache_key = f"portfolio_{account_id}"
-    now = time.time()
+    data = _lookup_portfolio_positions(account_id, cache_key)
+    if data is not None:
+        return data
 
-    if use_cache:
-        with _cache_lock:
-            if cache_key in _cache:
-                data, timestamp = _cache[cache_key]
-                if now - timestamp < _cache_ttl:
-                    logger.info(f"Используются кэшированные данные портфеля (возраст: {now - timestamp:.1f}s)")
-                    return data
+    # Промах кэша: загрузку выполняет один поток на ключ, остальные ждут
+    # её завершения и берут готовый результат из кэша вместо повторного запроса
+    with _cache_lock:
+        key_lock = _key_locks.setdefault(cache_key, threading.Lock())
+
+    with key_lock:
+        data = _lookup_portfolio_positions(account_id, cache_key)
+        if data is not None:
+            return data
+
+        now = time.time()
+        result = _load_portfolio_positions(account_id)
+        if result is None:
+            return [], None, account_id
+
+        # Сохраняем в кэш (thread-safe)
+        _store_portfolio_positions(cache_key, result, now)
+        return result
+
+
+def _lookup_portfolio_positions(account_id: str, cache_key: Tuple[str, str]) -> Optional[Tuple]:
+    """
+    Ищет позиции портфеля в кэше.
+
+    Свежие данные возвращаются как есть. Устаревшие, но ещё допустимые данные
+    тоже возвращаются, а их обновление запускается в фоне.
+
+    Args:
+        account_id: Идентификатор счёта
+        cache_key: Ключ записи в кэше
+
+    Returns:
+        Optional[Tuple]: Результат для get_portfolio_positions или None при промахе
+    """
+    with _cache_lock:
+        entry = _cache.get(cache_key)
+
+    if not entry:
+        return None
+
+    data, timestamp = entry
+    age = time.time() - timestamp
+    if age < _cache_ttl:
+        logger.debug("Используются кэшированные данные портфеля (возраст: %.1fs)", age)
+        return data
+    # Запись старше _cache_ttl + _cache_stale_ttl уже удалена из TTLCache,
+    # поэтому здесь данные устаревшие, но ещё допустимые: отдаём их сразу,
+    # а свежие загружаем в фоне
+    _schedule_portfolio_refresh(account_id, cache_key)
+    logger.info("Используются устаревшие данные портфеля, запущено фоновое обновление")
+    return data
+
+
+def _load_portfolio_positions(account_id: str) -> Optional[Tuple[List[Dict], Dict, str]]:
+    """
+    Загружает портфель из API и извлекает из него позиции-акции.
+
+    Args:
+        account_id: Идентификатор счёта
 
+    Returns:
+        Optional[Tuple[List[Dict], Dict, str]]: Результат для get_portfolio_positions
+            или None, если портфель получить не удалось
+    """
     # Получаем портфель
     portfolio = get_portfolio(account_id)
     if not portfolio:
-        return [], None, account_id
+        return None
 
     # Извлекаем только позиции с типом "share" (акции)
     positions = portfolio.get("positions", [])
     virtual_positions = portfolio.get("virtualPositions", [])
 
-    shares = [pos for pos in positions if pos.get("instrumentType") == "share"]
-    virtual_shares = []
-
-    for pos in virtual_positions:
-        if pos.get("instrumentType") == "share":
-            pos_with_flag = pos.copy()
-            pos_with_flag["is_virtual"] = True
-            virtual_shares.append(pos_with_flag)
+    shares = [pos for pos in positions if pos.get("instrumentType") == INSTRUMENT_TYPE_SHARE]
+    # Подарочные позиции помечаем флагом is_virtual: новый словарь собирается
+    # за одну операцию вместо copy() с последующей вставкой ключа
+    virtual_shares = [
+        {**pos, "is_virtual": True}
+        for pos in virtual_positions
+        if pos.get("instrumentType") == INSTRUMENT_TYPE_SHARE
+    ]
 
     all_shares = shares + virtual_shares
 
     logger.info(
-        f"Найдено {len(all_shares)} акций в портфеле (вкл. подарочные: {len(virtual_shares)})"
+        "Найдено %s акций в портфеле (вкл. подарочные: %s)",
+        len(all_shares), len(virtual_shares)
     )
 
-    result = (all_shares, portfolio, account_id)
+    return all_shares, portfolio, account_id
 
-    # Сохраняем в кэш (thread-safe)
-    if use_cache:
-        with _cache_lock:
-            _cache[cache_key] = (result, now)
-            logger.info("Данные портфеля сохранены в кэш")
 
-    return result
+def _store_portfolio_positions(cache_key: Tuple[str, str], result: Tuple, now: float):
+    """Сохраняет позиции портфеля в кэш. Thread-safe."""
+    with _cache_lock:
+        _cache[cache_key] = (result, now)
+    logger.debug("Данные портфеля сохранены в кэш")
+
+
+def _schedule_portfolio_refresh(account_id: str, cache_key: Tuple[str, str]):
+    """
+    Запускает фоновое обновление кэша портфеля.
+    Повторные вызовы, пока обновление ещё идёт, игнорируются.
+
+    Args:
+        account_id: Идентификатор счёта
+        cache_key: Ключ записи в кэше
+    """
+    with _cache_lock:
+        if cache_key in _refreshing_keys:
+            return
+        _refreshing_keys.add(cache_key)
+
+    def refresh():
+        try:
+            result = _load_portfolio_positions(account_id)
+            if result is not None:
+                _store_portfolio_positions(cache_key, result, time.time())
+        except Exception as e:
+            logger.error("Ошибка при фоновом обновлении портфеля: %s", e, exc_info=True)
+        finally:
+            with _cache_lock:
+                _refreshing_keys.discard(cache_key)
+
+    threading.Thread(target=refresh, daemon=True).start()
 
 
 def get_withdraw_limits(account_id: str) -> Optional[Dict]:
@@ -247,37 +542,23 @@ def get_withdraw_limits(account_id: str) -> Optional[Dict]:
     Returns:
         Optional[Dict]: Данные лимитов на вывод или None
     """
-    url = f"{BASE_URL}/tinkoff.public.invest.api.contract.v1.OperationsService/GetWithdrawLimits"
-
     body = {"accountId": account_id}
 
-    session = get_session()
-
-    try:
-        logger.info(f"Запрос лимитов на вывод для счёта {account_id}")
-
-        response = session.post(
-            url,
-            json=body,
-            timeout=10,
-            verify=SSL_VERIFY
-        )
-
-        response.raise_for_status()
-        result = response.json()
-
-        if not result:
-            logger.warning("API вернул пустые лимиты на вывод")
-            return None
+    logger.debug("Запрос лимитов на вывод для счёта %s", account_id)
 
-        logger.info("Успешно получены лимиты на вывод")
-        return result
+    result = _post_json(_URL_GET_WITHDRAW_LIMITS, body, "Ошибка при запросе лимитов на вывод")
+    if result is None:
+        return None
 
-    except requests.exceptions.RequestException as err:
-        logger.error(f"Ошибка при запросе лимитов на вывод: {err}")
+    if not result:
+        logger.warning("API вернул пустые лимиты на вывод")
         return None
 
+    logger.info("Успешно получены лимиты на вывод")
+    return result
+
 
+@_ttl_cached(maxsize=4, ttl=_shares_cache_ttl)
 def fetch_shares(instrument_status: str = "INSTRUMENT_STATUS_BASE") -> List[Dict]:
     """
     Получает список акций через REST API T-Invest.
@@ -290,44 +571,32 @@ def fetch_shares(instrument_status: str = "INSTRUMENT_STATUS_BASE") -> List[Dict
     Returns:
         List[Dict]: Список акций с информацией
     """
-    url = f"{BASE_URL}/tinkoff.public.invest.api.contract.v1.InstrumentsService/Shares"
-
     body = {
         "instrument_status": instrument_status
     }
 
-    session = get_session()
-
-    try:
-        logger.info(f"Запрос списка акций с статусом: {instrument_status}")
-
-        response = session.post(
-            url,
-            json=body,
-            timeout=10,
-            verify=SSL_VERIFY
-        )
+    logger.debug("Запрос списка акций с статусом: %s", instrument_status)
 
-        response.raise_for_status()
-        result = response.json()
-
-        instruments = result.get("instruments", [])
-
-        if not instruments:
-            logger.warning("API вернул пустой список инструментов")
-            return []
+    # Список всех акций может занимать несколько мегабайт и меняется редко,
+    # поэтому запрос условный: при неизменном списке сервер отвечает 304
+    result = _post_json(_URL_SHARES, body, "Ошибка при запросе к T-Invest API", conditional=True)
+    if result is None:
+        return []
 
-        logger.info(f"Успешно получено {len(instruments)} акций")
-        return instruments
+    instruments = result.get("instruments", [])
 
-    except requests.exceptions.RequestException as err:
-        logger.error(f"Ошибка при запросе к T-Invest API: {err}")
+    if not instruments:
+        logger.warning("API вернул пустой список инструментов")
         return []
 
+    logger.info("Успешно получено %s акций", len(instruments))
+    return instruments
+
 
+@_ttl_cached(maxsize=8192, ttl=_share_info_cache_ttl)
 def get_share_info(figi: str) -> Optional[Dict]:
     """
-    Получает детальную информацию об акции по FIGI.
+    Получает детальную информацию об акции по FIGI методом ShareBy.
 
     Args:
         figi: Идентификатор финансового инструмента
@@ -335,43 +604,34 @@ def get_share_info(figi: str) -> Optional[Dict]:
     Returns:
         Optional[Dict]: Информация об акции или None в случае ошибки
     """
-    url = f"{BASE_URL}/tinkoff.public.invest.api.contract.v1.InstrumentsService/ShareBy"
-
     body = {
         "id_type": "INSTRUMENT_ID_TYPE_FIGI",
         "class_code": "",
         "id": figi
     }
 
-    session = get_session()
-
-    try:
-        logger.info(f"Запрос информации об акции с FIGI: {figi}")
-
-        response = session.post(
-            url,
-            json=body,
-            timeout=10,
-            verify=SSL_VERIFY
-        )
+    logger.debug("Запрос информации об акции с FIGI: %s", figi)
 
-        response.raise_for_status()
-        result = response.json()
-
-        instrument = result.get("instrument")
-
-        if not instrument:
-            logger.warning(f"Инструмент с FIGI {figi} не найден")
-            return None
+    result = _post_json(_URL_SHARE_BY, body, "Ошибка при запросе информации об акции")
+    if result is None:
+        return None
 
-        logger.info(f"Успешно получена информация об акции {instrument.get('ticker', 'N/A')}")
-        return instrument
+    instrument = result.get("instrument")
 
-    except requests.exceptions.RequestException as err:
-        logger.error(f"Ошибка при запросе информации об акции: {err}")
+    if not instrument:
+        logger.warning("Инструмент с FIGI %s не найден", figi)
         return None
 
+    logger.info("Успешно получена информация об акции %s", instrument.get("ticker", "N/A"))
+    return instrument
 
+
+# Цены кэшируются на то же время, что и портфель; ключ не зависит от порядка FIGI
+@_ttl_cached(
+    maxsize=256,
+    ttl=_cache_ttl,
+    key=lambda figis: hashkey(tuple(sorted(figis)))
+)
 def get_last_prices(figis: List[str]) -> Optional[Dict]:
     """
     Получает последние цены для списка инструментов.
@@ -382,40 +642,25 @@ def get_last_prices(figis: List[str]) -> Optional[Dict]:
     Returns:
         Optional[Dict]: Словарь с ценами или None
     """
-    url = f"{BASE_URL}/tinkoff.public.invest.api.contract.v1.MarketDataService/GetLastPrices"
-
     body = {
         "instrument_id": figis
     }
 
-    session = get_session()
+    logger.debug("Запрос последних цен для %s инструментов", len(figis))
 
-    try:
-        logger.info(f"Запрос последних цен для {len(figis)} инструментов")
-
-        response = session.post(
-            url,
-            json=body,
-            timeout=10,
-            verify=SSL_VERIFY
-        )
-
-        response.raise_for_status()
-        result = response.json()
-
-        last_prices = result.get("last_prices", [])
-
-        if not last_prices:
-            logger.warning("API не вернул информацию о ценах")
-            return None
+    result = _post_json(_URL_GET_LAST_PRICES, body, "Ошибка при запросе последних цен")
+    if result is None:
+        return None
 
-        logger.info(f"Успешно получены цены для {len(last_prices)} инструментов")
-        return result
+    last_prices = result.get("last_prices", [])
 
-    except requests.exceptions.RequestException as err:
-        logger.error(f"Ошибка при запросе последних цен: {err}")
+    if not last_prices:
+        logger.warning("API не вернул информацию о ценах")
         return None
 
+    logger.info("Успешно получены цены для %s инструментов", len(last_prices))
+    return result
+
 
 def get_candles(
         figi: str,
@@ -442,8 +687,6 @@ def get_candles(
     Returns:
         Optional[List[Dict]]: Список свечей или None в случае ошибки
     """
-    url = f"{BASE_URL}/tinkoff.public.invest.api.contract.v1.MarketDataService/GetCandles"
-
     body = {
         "figi": figi,
         "from": from_date,
@@ -451,33 +694,94 @@ def get_candles(
         "interval": interval
     }
 
-    session = get_session()
+    logger.debug("Запрос свечей для %s с %s по %s, интервал: %s", figi, from_date, to_date, interval)
 
-    try:
-        logger.info(f"Запрос свечей для {figi} с {from_date} по {to_date}, интервал: {interval}")
+    result = _post_json(_URL_GET_CANDLES, body, "Ошибка при запросе свечей", timeout=15)
+    if result is None:
+        return None
 
-        response = session.post(
-            url,
-            json=body,
-            timeout=15,
-            verify=SSL_VERIFY
-        )
+    candles = result.get("candles", [])
 
-        response.raise_for_status()
-        result = response.json()
+    if not candles:
+        logger.warning("API не вернул свечи для %s", figi)
+        return []
 
-        candles = result.get("candles", [])
+    logger.debug("Успешно получено %s свечей для %s", len(candles), figi)
+    return candles
 
-        if not candles:
-            logger.warning(f"API не вернул свечи для {figi}")
-            return []
 
-        logger.info(f"Успешно получено {len(candles)} свечей для {figi}")
-        return candles
+def get_candles_bulk(
+        figis: List[str],
+        from_date: str,
+        to_date: str,
+        interval: str = "CANDLE_INTERVAL_DAY"
+) -> Dict[str, List[Dict]]:
+    """
+    Получает исторические свечи сразу для нескольких инструментов.
+
+    В API нет пакетного метода для свечей, поэтому запросы GetCandles
+    отправляются параллельно (не более MAX_PARALLEL_REQUESTS одновременно)
+    через общий пул соединений.
 
-    except requests.exceptions.RequestException as err:
-        logger.error(f"Ошибка при запросе свечей: {err}")
-        return None
+    Args:
+        figis: Список FIGI инструментов
+        from_date: Начальная дата в формате ISO 8601
+        to_date: Конечная дата в формате ISO 8601
+        interval: Интервал свечей (см. get_candles)
+
+    Returns:
+        Dict[str, List[Dict]]: Свечи по FIGI; инструменты без свечей
+            или с ошибкой запроса в результат не попадают
+    """
+    candles_by_figi = {}
+    if not figis:
+        return candles_by_figi
+
+    # Время уходит на ожидание ответов API, а requests отпускает GIL
+    # во время сетевого ввода-вывода
+    workers = min(MAX_PARALLEL_REQUESTS, len(figis))
+    with _executor(workers) as executor:
+        futures = {
+            executor.submit(get_candles, figi, from_date, to_date, interval): figi
+            for figi in figis
+        }
+        for future in as_completed(futures):
+            candles = future.result()
+            if candles:
+                candles_by_figi[futures[future]] = candles
+
+    return candles_by_figi
+
+
+def _portfolio_holdings(positions: List[Dict], portfolio: Optional[Dict]) -> Tuple[float, Dict[str, float]]:
+    """
+    Извлекает из портфеля баланс и количество каждой акции.
+
+    Обычная и подарочная (виртуальная) позиции одной акции имеют один FIGI,
+    поэтому их количества складываются.
+
+    Args:
+        positions: Позиции портфеля
+        portfolio: Данные портфеля
+
+    Returns:
+        Tuple[float, Dict[str, float]]: Баланс и ненулевые количества акций по FIGI
+    """
+    current_balance = 0.0
+    if portfolio:
+        total_amount = portfolio.get("totalAmountCurrencies", {})
+        if total_amount:
+            current_balance = format_quotation(total_amount)
+
+    quantities = {}
+    for position in positions:
+        figi = position.get("figi")
+        quantity = format_quotation(position.get("quantity", {}))
+
+        if figi and quantity != 0:
+            quantities[figi] = quantities.get(figi, 0.0) + quantity
+
+    return current_balance, quantities
 
 
 def get_portfolio_history(
@@ -507,16 +811,12 @@ def get_portfolio_history(
             logger.warning("Невозможно рассчитать историю портфеля - нет позиций")
             return []
 
-        # Получаем текущий баланс
-        current_balance = 0.0
-        if portfolio:
-            total_amount = portfolio.get("totalAmountCurrencies", {})
-            if total_amount:
-                current_balance = format_quotation(total_amount)
+        # Текущий баланс и количество каждой акции по FIGI
+        current_balance, quantities = _portfolio_holdings(positions, portfolio)
 
         # Определяем интервал на основе разницы дат
-        start = datetime.fromisoformat(from_date.replace('Z', '+00:00'))
-        end = datetime.fromisoformat(to_date.replace('Z', '+00:00'))
+        start = parse_timestamp(from_date)
+        end = parse_timestamp(to_date)
         diff_days = (end - start).days
 
         if diff_days <= 1:
@@ -528,106 +828,183 @@ def get_portfolio_history(
         else:
             interval = "CANDLE_INTERVAL_DAY"
 
-        # Словарь для хранения исторических данных по каждой позиции
-        position_histories = {}
+        # Получаем исторические свечи для всех акций за один параллельный проход
+        candles_by_figi = get_candles_bulk(list(quantities), from_date, to_date, interval)
 
-        for position in positions:
-            figi = position.get("figi")
-            quantity = format_quotation(position.get("quantity", {}))
-
-            if not figi or quantity == 0:
-                continue
-
-            # Получаем исторические свечи для акции
-            candles = get_candles(figi, from_date, to_date, interval)
-
-            if candles:
-                position_histories[figi] = {
-                    'quantity': quantity,
-                    'candles': candles
-                }
-
-        if not position_histories:
+        if not candles_by_figi:
             logger.warning("Не удалось получить исторические данные для позиций")
             return []
 
-        # Создаем словарь timestamp -> total_value
-        value_by_time = {}
-
-        # Для каждой временной точки рассчитываем общую стоимость портфеля
-        for figi, hist_data in position_histories.items():
-            quantity = hist_data['quantity']
-            candles = hist_data['candles']
-
-            for candle in candles:
+        figis = list(candles_by_figi)
+
+        # Все временные точки истории. Метки времени в ISO 8601 одного формата,
+        # поэтому строки сортируются в хронологическом порядке без разбора
+        times = sorted({
+            candle['time']
+            for candles in candles_by_figi.values()
+            for candle in candles
+            if candle.get('time')
+        })
+        time_index = {timestamp: j for j, timestamp in enumerate(times)}
+
+        # Матрица цен закрытия [акция × временная точка]. Если у акции нет свечи
+        # в какой-то момент, её вклад в стоимость портфеля в этот момент нулевой
+        close_prices = np.zeros((len(figis), len(times)), dtype=np.float64)
+        for i, figi in enumerate(figis):
+            for candle in candles_by_figi[figi]:
                 timestamp = candle.get('time')
-                if not timestamp:
-                    continue
+                if timestamp:
+                    close_prices[i, time_index[timestamp]] = format_quotation(candle.get('close', {}))
 
-                # Используем цену закрытия свечи
-                close_price = format_quotation(candle.get('close', {}))
+        # Стоимость портфеля в каждой точке: баланс + Σ количество × цена закрытия
+        position_quantities = np.array([quantities[figi] for figi in figis], dtype=np.float64)
+        values = current_balance + position_quantities @ close_prices
 
-                if timestamp not in value_by_time:
-                    value_by_time[timestamp] = current_balance
-
-                value_by_time[timestamp] += quantity * close_price
-
-        # Преобразуем в список отсортированных значений
         history = []
-        for timestamp_str, value in sorted(value_by_time.items()):
+        for timestamp_str, value in zip(times, values.tolist()):
             try:
-                timestamp = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
+                timestamp = parse_timestamp(timestamp_str)
                 history.append({
                     'timestamp': timestamp,
                     'value': value
                 })
             except Exception as e:
-                logger.warning(f"Не удалось преобразовать timestamp {timestamp_str}: {e}")
+                logger.warning("Не удалось преобразовать timestamp %s: %s", timestamp_str, e)
                 continue
 
-        logger.info(f"Рассчитана история портфеля: {len(history)} точек")
+        logger.info("Рассчитана история портфеля: %s точек", len(history))
         return history
 
     except Exception as e:
-        logger.error(f"Ошибка при расчёте истории портфеля: {e}", exc_info=True)
+        logger.error("Ошибка при расчёте истории портфеля: %s", e, exc_info=True)
         return None
 
 
-def get_portfolio_value_yesterday(account_id: str) -> Optional[float]:
+def get_portfolio_value_at(account_id: str, at: datetime) -> Optional[float]:
     """
-    Получает стоимость портфеля на вчерашний день (для расчёта изменения за сегодня).
+    Оценивает стоимость портфеля на заданный момент без построения полной истории.
+
+    Берёт текущие позиции (из кэша) и цену закрытия последней дневной свечи
+    каждой акции до указанного момента.
 
     Args:
         account_id: Идентификатор счёта
+        at: Момент времени (UTC, без tzinfo)
 
     Returns:
-        Optional[float]: Стоимость портфеля на вчерашний день или None
+        Optional[float]: Стоимость портфеля или None
     """
     try:
-        # Определяем временной диапазон (вчера)
-        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-        yesterday = today - timedelta(days=1)
+        positions, portfolio, _ = get_portfolio_positions(account_id)
 
-        from_date = yesterday.isoformat() + "Z"
-        to_date = today.isoformat() + "Z"
+        if not positions:
+            logger.warning("Невозможно оценить стоимость портфеля - нет позиций")
+            return None
 
-        # Получаем историю портфеля
-        history = get_portfolio_history(account_id, from_date, to_date)
+        current_balance, quantities = _portfolio_holdings(positions, portfolio)
 
-        if history and len(history) > 0:
-            # Берём последнее значение (самое близкое к концу вчерашнего дня)
-            yesterday_value = history[-1]['value']
-            logger.info(f"Стоимость портфеля на вчера: {yesterday_value}")
-            return yesterday_value
-        else:
-            logger.warning("Не удалось получить стоимость портфеля на вчера")
+        # Берём окно в несколько дней, чтобы после выходных и праздников
+        # у каждой акции нашлась последняя торговая свеча
+        from_date = (at - timedelta(days=PORTFOLIO_VALUE_LOOKBACK_DAYS)).isoformat() + "Z"
+        to_date = at.isoformat() + "Z"
+        candles_by_figi = get_candles_bulk(list(quantities), from_date, to_date, "CANDLE_INTERVAL_DAY")
+
+        if not candles_by_figi:
+            logger.warning("Не удалось получить дневные свечи для позиций")
             return None
 
+        value = current_balance
+        for figi, candles in candles_by_figi.items():
+            value += quantities[figi] * format_quotation(candles[-1].get('close', {}))
+
+        return value
+
     except Exception as e:
-        logger.error(f"Ошибка при получении стоимости портфеля на вчера: {e}", exc_info=True)
+        logger.error("Ошибка при оценке стоимости портфеля: %s", e, exc_info=True)
         return None
 
 
+def get_portfolio_value_yesterday(account_id: str) -> Optional[float]:
+    """
+    Получает стоимость портфеля на вчерашний день (для расчёта изменения за сегодня).
+
+    Args:
+        account_id: Идентификатор счёта
+
+    Returns:
+        Optional[float]: Стоимость портфеля на вчерашний день или None
+    """
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    yesterday_value = get_portfolio_value_at(account_id, today)
+
+    if yesterday_value is not None:
+        logger.info("Стоимость портфеля на вчера: %s", yesterday_value)
+    else:
+        logger.warning("Не удалось получить стоимость портфеля на вчера")
+
+    return yesterday_value
+
+
+def fetch_dashboard(account_id: str, figis: List[str]) -> Dict:
+    """
+    Параллельно загружает данные для экрана портфеля: лимиты на вывод,
+    последние цены позиций и стоимость портфеля на вчера.
+    Запросы независимы, поэтому общее время равно самому долгому из них.
+
+    Args:
+        account_id: Идентификатор счёта
+        figis: Список FIGI позиций портфеля
+
+    Returns:
+        Dict: Словарь с ключами 'limits', 'prices' и 'yesterday_value'
+            (None для данных, которые не удалось получить)
+    """
+    with _executor(3) as executor:
+        limits = executor.submit(get_withdraw_limits, account_id)
+        prices = executor.submit(get_last_prices, figis) if figis else None
+        yesterday_value = executor.submit(get_portfolio_value_yesterday, account_id)
+
+        return {
+            'limits': limits.result(),
+            'prices': prices.result() if prices else None,
+            'yesterday_value': yesterday_value.result()
+        }
+
+
+@lru_cache(maxsize=4096)
+def parse_timestamp(timestamp_str: str) -> datetime:
+    """
+    Преобразует метку времени API (ISO 8601, например '2024-01-01T07:00:00Z') в datetime.
+
+    Результат кэшируется: одни и те же метки свечей приходят для всех акций
+    портфеля и при повторных запросах графиков.
+
+    Args:
+        timestamp_str: Метка времени в формате ISO 8601
+
+    Returns:
+        datetime: Дата и время с часовым поясом
+    """
+    return datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
+
+
+@lru_cache(maxsize=4096)
+def _quotation_value(units: str, nano: int) -> float:
+    """
+    Переводит пару units/nano из ответа API в число.
+    Одни и те же цены повторяются в свечах и позициях, поэтому результат
+    кэшируется по исходной паре и строка units не разбирается повторно.
+
+    Args:
+        units: Целая часть (строка или число)
+        nano: Дробная часть в единицах 10^-9
+
+    Returns:
+        float: Значение в виде числа
+    """
+    return int(units) + nano / 1_000_000_000
+
+
 def format_quotation(quotation: Dict) -> float:
     """
     Форматирует объект Quotation в число.
@@ -641,7 +1018,14 @@ def format_quotation(quotation: Dict) -> float:
     if not quotation:
         return 0.0
 
-    # Получаем units и nano
+    # Быстрый путь для типичного ответа API: units (int64) приходит строкой,
+    # nano (int32) - числом. Вызывается для каждой свечи и позиции
+    try:
+        return _quotation_value(quotation["units"], quotation["nano"])
+    except (KeyError, TypeError, ValueError):
+        pass
+
+    # Медленный путь: отсутствующие поля, пустые строки и другие типы
     units = quotation.get("units", 0)
     nano = quotation.get("nano", 0)
 
@@ -659,4 +1043,24 @@ def format_quotation(quotation: Dict) -> float:
     # Преобразуем nano (дробная часть в единицах 10^-9) в дробную часть
     value = units + (nano / 1_000_000_000)
 
-    return value
\ No newline at end of file
+    return value
+
+
+def get_price_map(prices_data: Optional[Dict]) -> Dict[str, float]:
+    """
+    Разбирает ответ get_last_prices в словарь цен по FIGI.
+    Ответ разбирается один раз, дальше цены берутся из словаря.
+
+    Args:
+        prices_data: Ответ get_last_prices или None
+
+    Returns:
+        Dict[str, float]: Последние цены по FIGI
+    """
+    if not prices_data:
+        return {}
+
+    return {
+        price_item.get("figi"): format_quotation(price_item.get("price", {}))
+        for price_item in prices_data.get("last_prices", [])
+    }
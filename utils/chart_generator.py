@@ -4,25 +4,134 @@
 import matplotlib
 matplotlib.use('Agg')  # Использование non-GUI backend для серверных приложений
 
+import hashlib
 import io
 import logging
-from datetime import datetime
-from typing import List, Dict
-import matplotlib.pyplot as plt
+import math
+import threading
+from datetime import datetime, timezone
+from types import MappingProxyType
+from functools import lru_cache
+from operator import itemgetter
+from typing import List, Dict, Tuple
 import matplotlib.dates as mdates
 from matplotlib.ticker import FuncFormatter
+from matplotlib.axes import Axes
+from matplotlib.lines import Line2D
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import numpy as np
+from cachetools import TTLCache
 
 logger = logging.getLogger(__name__)
 
 # Настройка шрифта для избежания предупреждений
-plt.rcParams['font.family'] = 'sans-serif'
-plt.rcParams['font.sans-serif'] = ['Arial', 'Helvetica', 'DejaVu Sans']
+matplotlib.rcParams['font.family'] = 'sans-serif'
+matplotlib.rcParams['font.sans-serif'] = ['Arial', 'Helvetica', 'DejaVu Sans']
+# Длинные линии Agg рисует частями, что избавляет от медленной отрисовки
+# путей из десятков тысяч вершин
+matplotlib.rcParams['agg.path.chunksize'] = 10000
+
+# Символы валют для подписей. API возвращает коды валют в нижнем регистре,
+# поэтому поиск идёт по коду в верхнем
+_CURRENCY_SYMBOLS = MappingProxyType({
+    "RUB": "₽",
+    "USD": "$",
+    "EUR": "€"
+})
+
+# Разрешение графиков: фигура 12x7 дюймов даёт 1200x700 пикселей,
+# этого достаточно для фото в Telegram, который всё равно пережимает изображения
+CHART_DPI = 100
+
+# Максимальное число точек на линии графика. Больше точек всё равно
+# не различить на изображении шириной 1200 пикселей
+MAX_CHART_POINTS = 2000
+
+# Быстрое сжатие PNG: размер файла почти не меняется, а сохранение заметно быстрее
+_PNG_PIL_KWARGS = {'compress_level': 1}
+
+# Готовые графики по содержимому ряда и параметрам отрисовки: повторный
+# запрос того же графика (обновление, несколько пользователей) не рисуется заново
+_chart_cache_ttl = 60
+_chart_cache = TTLCache(maxsize=64, ttl=_chart_cache_ttl)
+_chart_cache_lock = threading.Lock()
+
+# Цвет и знак изменения (роста или падения): индекс - признак роста
+_CHANGE_STYLE = (('#ef4444', ''), ('#10b981', '+'))
+
+# Фигуры, переиспользуемые между графиками в пределах потока:
+# создание новой фигуры заметно дороже очистки осей
+_figure_local = threading.local()
+
+
+@lru_cache(maxsize=1024)
+def _format_tick_time(seconds: int, fmt: str) -> str:
+    """
+    Форматирует время деления оси X.
+    Подписи делений форматируются и при компоновке, и при отрисовке,
+    а одни и те же моменты времени повторяются от графика к графику,
+    поэтому результат кэшируется.
+
+    Args:
+        seconds: Секунды Unix (UTC)
+        fmt: Формат strftime
+
+    Returns:
+        str: Подпись деления
+    """
+    return datetime.fromtimestamp(seconds, timezone.utc).strftime(fmt)
+
+
+def _tick_time_formatter(fmt: str) -> FuncFormatter:
+    """
+    Создаёт форматтер оси X для дат matplotlib (дни от эпохи 1970-01-01).
 
+    Args:
+        fmt: Формат strftime
+
+    Returns:
+        FuncFormatter: Форматтер подписей оси
+    """
+    return FuncFormatter(lambda x, _: _format_tick_time(round(x * 86400), fmt))
+
+
+# Подписи и шаг делений оси X для каждого периода. Форматтеры не хранят
+# состояния и общие для всех графиков, а локаторы привязываются к оси,
+# поэтому для них хранятся фабрики
+_PERIOD_AXIS = {
+    # 1 час - каждые 10 минут
+    '1h': (_tick_time_formatter('%H:%M'), lambda: mdates.MinuteLocator(interval=10)),
+    # 1 день - каждые 4 часа
+    '1d': (_tick_time_formatter('%H:%M'), lambda: mdates.HourLocator(interval=4)),
+    # 1 неделя - каждый день
+    '1w': (_tick_time_formatter('%d.%m'), lambda: mdates.DayLocator(interval=1)),
+    # 1 месяц - каждые 3 дня
+    '1m': (_tick_time_formatter('%d.%m'), lambda: mdates.DayLocator(interval=3)),
+    # 1 год - каждые 2 недели (примерно 14 дней)
+    '1y': (_tick_time_formatter('%d.%m'), lambda: mdates.WeekdayLocator(interval=2)),
+}
+
+
+def get_currency_symbol(currency: str) -> str:
+    """
+    Возвращает символ валюты по её коду (в любом регистре).
 
+    Args:
+        currency: Код валюты
+
+    Returns:
+        str: Символ валюты или сам код, если символ неизвестен
+    """
+    return _CURRENCY_SYMBOLS.get(currency.upper(), currency)
+
+
+@lru_cache(maxsize=1024)
 def format_currency(value: float, currency: str = "RUB") -> str:
     """
     Форматирует значение в валюту.
+    Вызывается для каждой подписи оси Y графика баланса, а значения
+    делений повторяются от графика к графику, поэтому результат кэшируется.
 
     Args:
         value: Числовое значение
@@ -31,16 +140,7 @@ def format_currency(value: float, currency: str = "RUB") -> str:
     Returns:
         str: Отформатированная строка
     """
-    currency_symbols = {
-        "RUB": "₽",
-        "USD": "$",
-        "EUR": "€",
-        "rub": "₽",
-        "usd": "$",
-        "eur": "€"
-    }
-    symbol = currency_symbols.get(currency, currency)
-    return f"{value:,.0f}{symbol}"
+    return f"{value:,.0f}{get_currency_symbol(currency)}"
 
 
 def get_price_precision(price: float) -> int:
@@ -53,28 +153,26 @@ def get_price_precision(price: float) -> int:
     Returns:
         int: Количество знаков после запятой
     """
+    if price <= 0:
+        return 2
     if price < 1:
-        # Для цен < 1 рубля - до первых трёх ненулевых цифр после запятой
-        price_str = f"{price:.10f}"
-        after_dot = price_str.split('.')[1] if '.' in price_str else ""
-        non_zero_count = 0
-        for char in after_dot:
-            if char != '0':
-                non_zero_count += 1
-            if non_zero_count >= 3:
-                return len(after_dot[:after_dot.index(char) + 1])
-        return 10  # Максимум 10 знаков
-    elif price >= 1 and price < 10:
+        # Для цен < 1 рубля - три значащие цифры после запятой: позиция первой
+        # значащей цифры берётся из десятичного логарифма, без разбора строки
+        return min(-math.floor(math.log10(price)) + 2, 10)  # Максимум 10 знаков
+    # Нижние границы уже отсечены предыдущими проверками
+    if price < 10:
         return 3
-    elif price >= 10 and price < 1000:
+    if price < 1000:
         return 2
-    else:  # >= 1000
-        return 1
+    return 1  # >= 1000
 
 
+@lru_cache(maxsize=1024)
 def format_price_with_precision(value: float, currency: str = "RUB") -> str:
     """
     Форматирует цену с правильной точностью.
+    Вызывается для каждой подписи оси Y, а значения делений повторяются
+    от графика к графику, поэтому результат кэшируется.
 
     Args:
         value: Значение цены
@@ -83,15 +181,7 @@ def format_price_with_precision(value: float, currency: str = "RUB") -> str:
     Returns:
         str: Отформатированная строка
     """
-    currency_symbols = {
-        "RUB": "₽",
-        "USD": "$",
-        "EUR": "€",
-        "rub": "₽",
-        "usd": "$",
-        "eur": "€"
-    }
-    symbol = currency_symbols.get(currency, currency)
+    symbol = get_currency_symbol(currency)
     precision = get_price_precision(abs(value))
 
     # Форматируем с нужной точностью
@@ -100,7 +190,137 @@ def format_price_with_precision(value: float, currency: str = "RUB") -> str:
     return f"{formatted}{symbol}"
 
 
-def calculate_linear_trend(x_values: np.ndarray, y_values: np.ndarray) -> tuple:
+def _get_figure(figsize: Tuple[float, float]) -> Tuple[Figure, Axes]:
+    """
+    Возвращает фигуру и оси текущего потока для нового графика.
+    Фигура создаётся при первом обращении, а дальше только очищается.
+
+    Args:
+        figsize: Размер фигуры в дюймах
+
+    Returns:
+        Tuple[Figure, Axes]: Фигура и её оси
+    """
+    figures = getattr(_figure_local, 'figures', None)
+    if figures is None:
+        figures = _figure_local.figures = {}
+
+    if figsize in figures:
+        fig, ax = figures[figsize]
+        ax.clear()
+    else:
+        # Фигура с собственным холстом Agg не регистрируется в менеджере
+        # фигур pyplot, поэтому её не нужно закрывать и она не копится в нём
+        fig = Figure(figsize=figsize)
+        FigureCanvasAgg(fig)
+        ax = fig.subplots()
+        figures[figsize] = (fig, ax)
+
+    return fig, ax
+
+
+def _set_period_axis(ax: Axes, period: str):
+    """
+    Настраивает подписи и шаг делений оси X для периода графика.
+    Для неизвестного периода остаются автоматические настройки matplotlib.
+
+    Args:
+        ax: Оси графика
+        period: Период отображения ('1h', '1d', '1w', '1m', '1y')
+    """
+    axis_settings = _PERIOD_AXIS.get(period)
+    if axis_settings is None:
+        return
+
+    formatter, make_locator = axis_settings
+    ax.xaxis.set_major_formatter(formatter)
+    ax.xaxis.set_major_locator(make_locator())
+
+
+def _plot_trend(ax: Axes, dates: np.ndarray, x_numeric: np.ndarray, y_values: np.ndarray):
+    """
+    Рисует линию тренда ряда.
+
+    Для двух точек тренд совпадает с самим графиком, а для ровного ряда
+    это горизонталь поверх графика, поэтому в этих случаях линия не рисуется.
+    Тренд - прямая, поэтому рисуется по двум крайним точкам.
+
+    Args:
+        ax: Оси графика
+        dates: Даты точек (datetime64)
+        x_numeric: Секунды Unix точек
+        y_values: Значения точек
+    """
+    if len(y_values) < 3 or np.ptp(y_values) <= 1e-9 * max(abs(y_values.mean()), 1.0):
+        return
+
+    a, b = calculate_linear_trend(x_numeric, y_values)
+
+    # Значения линии тренда на краях ряда
+    trend_ends = a * x_numeric[[0, -1]] + b
+
+    # Определяем цвет тренда
+    trend_color = _CHANGE_STYLE[a >= 0][0]
+
+    ax.plot(dates[[0, -1]], trend_ends,
+            color=trend_color,
+            linestyle='--',
+            linewidth=2,
+            alpha=0.7,
+            label='Линия тренда',
+            zorder=2)
+
+
+def _figure_to_png(fig: Figure) -> bytes:
+    """
+    Сохраняет фигуру в PNG.
+    Компоновка уже рассчитана tight_layout, поэтому повторный проход
+    bbox_inches='tight' не нужен.
+
+    Args:
+        fig: Фигура matplotlib
+
+    Returns:
+        bytes: Изображение в формате PNG
+    """
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', dpi=CHART_DPI, pil_kwargs=_PNG_PIL_KWARGS)
+    # getvalue() отдаёт внутренний буфер BytesIO без копирования, а заранее
+    # выделенный буфер пришлось бы обнулять, обрезать и копировать
+    return buf.getvalue()
+
+
+@lru_cache(maxsize=8)
+def _currency_formatter(currency: str) -> FuncFormatter:
+    """
+    Возвращает форматтер оси Y для баланса в заданной валюте.
+    Форматтер создаётся один раз на валюту и переиспользуется всеми графиками.
+
+    Args:
+        currency: Код валюты
+
+    Returns:
+        FuncFormatter: Форматтер подписей оси
+    """
+    return FuncFormatter(lambda y, _: format_currency(y, currency))
+
+
+@lru_cache(maxsize=8)
+def _price_formatter(currency: str) -> FuncFormatter:
+    """
+    Возвращает форматтер оси Y для цены в заданной валюте с точностью,
+    зависящей от величины цены.
+
+    Args:
+        currency: Код валюты
+
+    Returns:
+        FuncFormatter: Форматтер подписей оси
+    """
+    return FuncFormatter(lambda y, _: format_price_with_precision(y, currency))
+
+
+def calculate_linear_trend(x_values: np.ndarray, y_values: np.ndarray) -> Tuple[float, float]:
     """
     Рассчитывает линейный тренд методом наименьших квадратов.
 
@@ -109,28 +329,227 @@ def calculate_linear_trend(x_values: np.ndarray, y_values: np.ndarray) -> tuple:
         y_values: Массив значений Y (цены/балансы)
 
     Returns:
-        tuple: (коэффициент наклона, свободный член)
+        Tuple[float, float]: (коэффициент наклона, свободный член)
     """
     if len(x_values) < 2:
-        return 0, np.mean(y_values) if len(y_values) > 0 else 0
+        # Не больше одной точки: тренд - горизонталь через неё
+        return 0.0, (float(y_values[0]) if len(y_values) > 0 else 0.0)
 
     # Линейная регрессия методом наименьших квадратов
     # y = a*x + b
-    n = len(x_values)
-    sum_x = np.sum(x_values)
-    sum_y = np.sum(y_values)
-    sum_xy = np.sum(x_values * y_values)
-    sum_x2 = np.sum(x_values ** 2)
+    # Считаем по отклонениям от средних: для временных меток порядка 1e9
+    # выражение n*Σx² - (Σx)² теряет почти все значащие цифры
+    x_mean = x_values.mean()
+    y_mean = y_values.mean()
+    x_centered = x_values - x_mean
 
     # Избегаем деления на ноль
-    denominator = n * sum_x2 - sum_x ** 2
-    if abs(denominator) < 1e-10:
-        return 0, np.mean(y_values)
+    denominator = np.dot(x_centered, x_centered)
+    if denominator < 1e-10:
+        return 0.0, float(y_mean)
+
+    a = np.dot(x_centered, y_values - y_mean) / denominator
+    b = y_mean - a * x_mean
+
+    return float(a), float(b)
+
+
+def _extract_series(data: List[Dict], key: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Извлекает ряд для графика в массивы NumPy.
+
+    Метки времени проходятся один раз: из секунд Unix получаются и числовая
+    ось X для расчётов, и массив datetime64, который matplotlib рисует
+    без преобразования каждого datetime по отдельности.
+
+    Args:
+        data: Список словарей с полем 'timestamp' (datetime с часовым поясом)
+            и числовым полем key
+        key: Имя поля со значениями
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: Даты (datetime64[us], UTC),
+            секунды Unix (float64) и значения (float64)
+    """
+    count = len(data)
+    x_numeric = np.fromiter((item['timestamp'].timestamp() for item in data), dtype=np.float64, count=count)
+    # itemgetter выбирает поле без вызова генератора на каждый элемент
+    y_values = np.fromiter(map(itemgetter(key), data), dtype=np.float64, count=count)
+    dates = np.rint(x_numeric * 1e6).astype(np.int64).view('datetime64[us]')
+    return dates, x_numeric, y_values
+
+
+def _lttb_indices(x_values: np.ndarray, y_values: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Выбирает точки для отображения алгоритмом Largest-Triangle-Three-Buckets.
+
+    Ряд делится на корзины, и из каждой берётся точка, образующая треугольник
+    наибольшей площади с предыдущей выбранной точкой и средним следующей корзины.
+    Так сохраняются пики и провалы, которые теряются при простом прореживании.
+
+    Args:
+        x_values: Массив значений X (возрастающий)
+        y_values: Массив значений Y
+        threshold: Максимальное число точек в результате
+
+    Returns:
+        np.ndarray: Индексы выбранных точек (первая и последняя всегда включены)
+    """
+    n = len(x_values)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    indices = np.empty(threshold, dtype=np.intp)
+    indices[0] = 0
+    indices[-1] = n - 1
+
+    bucket_size = (n - 2) / (threshold - 2)
+    selected = 0
+    for i in range(threshold - 2):
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+
+        # Среднее следующей корзины (для последней корзины - последняя точка)
+        avg_x = x_values[end:next_end].mean()
+        avg_y = y_values[end:next_end].mean()
+
+        # Удвоенные площади треугольников для всех точек текущей корзины
+        x_a = x_values[selected]
+        y_a = y_values[selected]
+        areas = np.abs(
+            (x_a - avg_x) * (y_values[start:end] - y_a)
+            - (x_a - x_values[start:end]) * (avg_y - y_a)
+        )
+
+        selected = start + int(areas.argmax())
+        indices[i + 1] = selected
 
-    a = (n * sum_xy - sum_x * sum_y) / denominator
-    b = (sum_y - a * sum_x) / n
+    return indices
 
-    return a, b
+
+def _render_series(
+    data: List[Dict],
+    key: str,
+    period: str,
+    currency: str,
+    line_color: str,
+    line_label: str,
+    ylabel: str,
+    title: str,
+    y_formatter: FuncFormatter
+) -> bytes:
+    """
+    Рисует график ряда со значениями в поле key и возвращает его в PNG.
+    Общая часть графиков баланса и цены акции.
+
+    Args:
+        data: Список словарей с полями 'timestamp' (datetime) и key (float)
+        key: Имя поля со значениями
+        period: Период отображения ('1h', '1d', '1w', '1m', '1y')
+        currency: Валюта для отображения
+        line_color: Цвет линии значений
+        line_label: Подпись линии значений в легенде
+        ylabel: Подпись оси Y
+        title: Заголовок графика
+        y_formatter: Форматтер подписей оси Y
+
+    Returns:
+        bytes: Изображение графика в формате PNG
+    """
+    # Извлекаем данные
+    dates, x_numeric, y_values = _extract_series(data, key)
+
+    if len(y_values) < 2:
+        return _generate_empty_chart("Недостаточно данных для графика")
+
+    # Ключ кэша: хэш ряда и всё, что влияет на изображение.
+    # Форматтер оси Y определяется полем значений и валютой
+    digest = hashlib.blake2b(x_numeric.tobytes(), digest_size=16)
+    digest.update(y_values.tobytes())
+    cache_key = (digest.digest(), key, period, currency, line_color, line_label, ylabel, title)
+
+    with _chart_cache_lock:
+        png = _chart_cache.get(cache_key)
+    if png is not None:
+        logger.debug("График '%s' для периода %s взят из кэша", title, period)
+        return png
+
+    # Создаем фигуру и оси с увеличенным размером для названий
+    fig, ax = _get_figure((12, 7))
+    fig.patch.set_facecolor('#f5f5f5')
+    ax.set_facecolor('#ffffff')
+
+    # Длинные ряды прореживаем до MAX_CHART_POINTS точек с сохранением пиков
+    plot_indices = _lttb_indices(x_numeric, y_values, MAX_CHART_POINTS)
+    plot_dates = dates[plot_indices]
+
+    # Строим график значений
+    ax.plot(plot_dates, y_values[plot_indices], linewidth=2.5, color=line_color, label=line_label, zorder=3)
+
+    # Линия тренда по всем точкам
+    _plot_trend(ax, dates, x_numeric, y_values)
+
+    # Рассчитываем изменение между ПЕРВЫМ и ПОСЛЕДНИМ значением
+    start_value = float(y_values[0])
+    end_value = float(y_values[-1])
+    change = end_value - start_value
+    change_percent = (change / start_value * 100) if start_value != 0 else 0
+
+    # Определяем цвет и символ для легенды (используем текст вместо эмодзи)
+    change_color, change_sign = _CHANGE_STYLE[change >= 0]
+
+    # Форматируем изменение с правильной точностью
+    change_label = f'Изменение: {change_sign}{format_price_with_precision(change, currency)} ({change_sign}{change_percent:.2f}%)'
+
+    # Информация о прибыли/убытке - только элемент легенды, поэтому
+    # на оси она не добавляется и не участвует в отрисовке
+    change_handle = Line2D([], [], color=change_color, linewidth=3, label=change_label)
+
+    # Настройка осей
+    ax.set_xlabel('Время', fontsize=12, fontweight='bold')
+    ax.set_ylabel(ylabel, fontsize=12, fontweight='bold')
+    ax.set_title(title, fontsize=14, fontweight='bold', pad=20)
+
+    # ИСПРАВЛЕНИЕ: Устанавливаем ylim с отступами сверху и снизу
+    min_value = y_values.min()
+    max_value = y_values.max()
+    value_range = max_value - min_value
+    if value_range == 0:
+        # Ровный ряд: отступы считаем от самого значения, иначе
+        # нижняя и верхняя границы совпадут
+        value_range = max(abs(max_value) * 0.05, 1.0)
+
+    ax.set_ylim(bottom=min_value - value_range * 0.2, top=max_value + value_range * 0.2)
+
+    # Форматирование оси X в зависимости от периода (упрощённые интервалы)
+    _set_period_axis(ax, period)
+
+    for label in ax.get_xticklabels():
+        label.set_rotation(45)
+        label.set_ha('right')
+
+    # Форматирование оси Y
+    ax.yaxis.set_major_formatter(y_formatter)
+
+    # Сетка
+    ax.grid(True, alpha=0.3, linestyle='--', linewidth=0.5)
+
+    # Легенда
+    handles, _ = ax.get_legend_handles_labels()
+    handles.append(change_handle)
+    ax.legend(handles=handles, loc='upper left', framealpha=0.95, fontsize=10)
+
+    # Плотная компоновка
+    fig.tight_layout()
+
+    # Сохранение в PNG
+    png = _figure_to_png(fig)
+
+    with _chart_cache_lock:
+        _chart_cache[cache_key] = png
+
+    return png
 
 
 def generate_balance_chart(
@@ -154,118 +573,20 @@ def generate_balance_chart(
         return _generate_empty_chart("Нет данных для отображения")
 
     try:
-        # Извлекаем данные
-        timestamps = [item['timestamp'] for item in data]
-        values = [item['value'] for item in data]
-
-        if len(values) < 2:
-            return _generate_empty_chart("Недостаточно данных для графика")
-
-        # Создаем фигуру и оси с увеличенным размером для названий
-        fig, ax = plt.subplots(figsize=(12, 7))
-        fig.patch.set_facecolor('#f5f5f5')
-        ax.set_facecolor('#ffffff')
-
-        # Строим график значений
-        ax.plot(timestamps, values, linewidth=2.5, color='#3b82f6', label='Баланс портфеля', zorder=3)
-
-        # Рассчитываем линию тренда
-        # Преобразуем timestamps в числа для расчёта
-        x_numeric = np.array([t.timestamp() for t in timestamps])
-        y_values = np.array(values)
-
-        a, b = calculate_linear_trend(x_numeric, y_values)
-
-        # Рассчитываем значения линии тренда
-        trend_values = a * x_numeric + b
-
-        # Определяем цвет тренда
-        trend_color = '#10b981' if a >= 0 else '#ef4444'
-
-        # Рисуем линию тренда
-        ax.plot(timestamps, trend_values,
-               color=trend_color,
-               linestyle='--',
-               linewidth=2,
-               alpha=0.7,
-               label='Линия тренда',
-               zorder=2)
-
-        # Рассчитываем изменение между ПЕРВЫМ и ПОСЛЕДНИМ значением
-        start_value = values[0]
-        end_value = values[-1]
-        profit_loss = end_value - start_value
-        profit_loss_percent = (profit_loss / start_value * 100) if start_value != 0 else 0
-
-        # Определяем цвет и символ для легенды (используем текст вместо эмодзи)
-        pl_color = '#10b981' if profit_loss >= 0 else '#ef4444'
-        pl_sign = '+' if profit_loss >= 0 else ''
-
-        # Форматируем изменение с правильной точностью
-        pl_label = f'Изменение: {pl_sign}{format_price_with_precision(profit_loss, currency)} ({pl_sign}{profit_loss_percent:.2f}%)'
-
-        # Добавляем информацию о прибыли/убытке в легенду
-        ax.plot([], [], color=pl_color, linewidth=3, label=pl_label)
-
-        # Настройка осей
-        ax.set_xlabel('Время', fontsize=12, fontweight='bold')
-        ax.set_ylabel('Баланс', fontsize=12, fontweight='bold')
-        ax.set_title('Динамика баланса портфеля', fontsize=14, fontweight='bold', pad=20)
-
-        # ИСПРАВЛЕНИЕ: Устанавливаем ylim с отступами сверху и снизу
-        max_value = max(values)
-        min_value = min(values)
-        value_range = max_value - min_value
-
-        ax.set_ylim(bottom=min_value - value_range * 0.2, top=max_value + value_range * 0.2)
-
-        # Форматирование оси X в зависимости от периода (упрощённые интервалы)
-        if period == '1h':
-            # 1 час - каждые 10 минут
-            ax.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
-            ax.xaxis.set_major_locator(mdates.MinuteLocator(interval=10))
-        elif period == '1d':
-            # 1 день - каждые 4 часа
-            ax.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
-            ax.xaxis.set_major_locator(mdates.HourLocator(interval=4))
-        elif period == '1w':
-            # 1 неделя - каждый день
-            ax.xaxis.set_major_formatter(mdates.DateFormatter('%d.%m'))
-            ax.xaxis.set_major_locator(mdates.DayLocator(interval=1))
-        elif period == '1m':
-            # 1 месяц - каждые 3 дня
-            ax.xaxis.set_major_formatter(mdates.DateFormatter('%d.%m'))
-            ax.xaxis.set_major_locator(mdates.DayLocator(interval=3))
-        elif period == '1y':
-            # 1 год - каждые 2 недели (примерно 14 дней)
-            ax.xaxis.set_major_formatter(mdates.DateFormatter('%d.%m'))
-            ax.xaxis.set_major_locator(mdates.WeekdayLocator(interval=2))
-
-        plt.xticks(rotation=45, ha='right')
-
-        # Форматирование оси Y
-        ax.yaxis.set_major_formatter(FuncFormatter(lambda y, _: format_currency(y, currency)))
-
-        # Сетка
-        ax.grid(True, alpha=0.3, linestyle='--', linewidth=0.5)
-
-        # Легенда
-        ax.legend(loc='upper left', framealpha=0.95, fontsize=10)
-
-        # Плотная компоновка
-        plt.tight_layout()
-
-        # Сохранение в буфер
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png', dpi=150, bbox_inches='tight')
-        buf.seek(0)
-        plt.close(fig)
-
-        logger.info(f"График баланса успешно сгенерирован для периода {period}")
-        return buf.getvalue()
+        png = _render_series(
+            data, 'value', period, currency,
+            line_color='#3b82f6',
+            line_label='Баланс портфеля',
+            ylabel='Баланс',
+            title='Динамика баланса портфеля',
+            y_formatter=_currency_formatter(currency)
+        )
+
+        logger.info("График баланса успешно сгенерирован для периода %s", period)
+        return png
 
     except Exception as e:
-        logger.error(f"Ошибка при генерации графика баланса: {e}", exc_info=True)
+        logger.error("Ошибка при генерации графика баланса: %s", e, exc_info=True)
         return _generate_empty_chart("Ошибка генерации графика")
 
 
@@ -290,131 +611,32 @@ def generate_stock_chart(
         bytes: Изображение графика в формате PNG
     """
     if not data:
-        logger.warning(f"Нет данных для построения графика акции {figi}")
+        logger.warning("Нет данных для построения графика акции %s", figi)
         return _generate_empty_chart("Нет данных для отображения")
 
     try:
-        # Извлекаем данные
-        timestamps = [item['timestamp'] for item in data]
-        prices = [item['price'] for item in data]
-
-        if len(prices) < 2:
-            return _generate_empty_chart("Недостаточно данных для графика")
-
-        # Создаем фигуру и оси с увеличенным размером для названий
-        fig, ax = plt.subplots(figsize=(12, 7))
-        fig.patch.set_facecolor('#f5f5f5')
-        ax.set_facecolor('#ffffff')
-
-        # Строим график цен
-        ax.plot(timestamps, prices, linewidth=2.5, color='#8b5cf6', label=f'Цена {stock_name}', zorder=3)
-
-        # Рассчитываем линию тренда
-        # Преобразуем timestamps в числа для расчёта
-        x_numeric = np.array([t.timestamp() for t in timestamps])
-        y_values = np.array(prices)
-
-        a, b = calculate_linear_trend(x_numeric, y_values)
-
-        # Рассчитываем значения линии тренда
-        trend_values = a * x_numeric + b
-
-        # Определяем цвет тренда
-        trend_color = '#10b981' if a >= 0 else '#ef4444'
-
-        # Рисуем линию тренда
-        ax.plot(timestamps, trend_values,
-               color=trend_color,
-               linestyle='--',
-               linewidth=2,
-               alpha=0.7,
-               label='Линия тренда',
-               zorder=2)
-
-        # Рассчитываем изменение между ПЕРВЫМ и ПОСЛЕДНИМ значением
-        start_price = prices[0]
-        end_price = prices[-1]
-        price_change = end_price - start_price
-        price_change_percent = (price_change / start_price * 100) if start_price != 0 else 0
-
-        # Определяем цвет и символ для легенды (используем текст вместо эмодзи)
-        pc_color = '#10b981' if price_change >= 0 else '#ef4444'
-        pc_sign = '+' if price_change >= 0 else ''
-
-        # Форматируем изменение с правильной точностью
-        pc_label = f'Изменение: {pc_sign}{format_price_with_precision(price_change, currency)} ({pc_sign}{price_change_percent:.2f}%)'
-
-        # Добавляем информацию о прибыли/убытке в легенду
-        ax.plot([], [], color=pc_color, linewidth=3, label=pc_label)
-
-        # Настройка осей
-        ax.set_xlabel('Время', fontsize=12, fontweight='bold')
-        ax.set_ylabel('Цена', fontsize=12, fontweight='bold')
-        ax.set_title(f'Динамика цены акции {stock_name}', fontsize=14, fontweight='bold', pad=20)
-
-        # ИСПРАВЛЕНИЕ: Устанавливаем ylim с отступами сверху и снизу
-        max_price = max(prices)
-        min_price = min(prices)
-        price_range = max_price - min_price
-
-        ax.set_ylim(bottom=min_price - price_range * 0.2, top=max_price + price_range * 0.2)
-
-        # Форматирование оси X в зависимости от периода (упрощённые интервалы)
-        if period == '1h':
-            # 1 час - каждые 10 минут
-            ax.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
-            ax.xaxis.set_major_locator(mdates.MinuteLocator(interval=10))
-        elif period == '1d':
-            # 1 день - каждые 4 часа
-            ax.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
-            ax.xaxis.set_major_locator(mdates.HourLocator(interval=4))
-        elif period == '1w':
-            # 1 неделя - каждый день
-            ax.xaxis.set_major_formatter(mdates.DateFormatter('%d.%m'))
-            ax.xaxis.set_major_locator(mdates.DayLocator(interval=1))
-        elif period == '1m':
-            # 1 месяц - каждые 3 дня
-            ax.xaxis.set_major_formatter(mdates.DateFormatter('%d.%m'))
-            ax.xaxis.set_major_locator(mdates.DayLocator(interval=3))
-        elif period == '1y':
-            # 1 год - каждые 2 недели (примерно 14 дней)
-            ax.xaxis.set_major_formatter(mdates.DateFormatter('%d.%m'))
-            ax.xaxis.set_major_locator(mdates.WeekdayLocator(interval=2))
-
-        plt.xticks(rotation=45, ha='right')
-
-        # Форматирование оси Y с правильной точностью
-        def format_y_axis(y, _):
-            return format_price_with_precision(y, currency)
-
-        ax.yaxis.set_major_formatter(FuncFormatter(format_y_axis))
-
-        # Сетка
-        ax.grid(True, alpha=0.3, linestyle='--', linewidth=0.5)
-
-        # Легенда
-        ax.legend(loc='upper left', framealpha=0.95, fontsize=10)
-
-        # Плотная компоновка
-        plt.tight_layout()
-
-        # Сохранение в буфер
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png', dpi=150, bbox_inches='tight')
-        buf.seek(0)
-        plt.close(fig)
-
-        logger.info(f"График акции {stock_name} успешно сгенерирован для периода {period}")
-        return buf.getvalue()
+        png = _render_series(
+            data, 'price', period, currency,
+            line_color='#8b5cf6',
+            line_label=f'Цена {stock_name}',
+            ylabel='Цена',
+            title=f'Динамика цены акции {stock_name}',
+            y_formatter=_price_formatter(currency)
+        )
+
+        logger.info("График акции %s успешно сгенерирован для периода %s", stock_name, period)
+        return png
 
     except Exception as e:
-        logger.error(f"Ошибка при генерации графика акции: {e}", exc_info=True)
+        logger.error("Ошибка при генерации графика акции: %s", e, exc_info=True)
         return _generate_empty_chart("Ошибка генерации графика")
 
 
+@lru_cache(maxsize=16)
 def _generate_empty_chart(message: str) -> bytes:
     """
     Генерирует пустой график с сообщением.
+    Изображение зависит только от текста сообщения, поэтому кэшируется.
 
     Args:
         message: Сообщение для отображения
@@ -422,7 +644,7 @@ def _generate_empty_chart(message: str) -> bytes:
     Returns:
         bytes: Изображение графика в формате PNG
     """
-    fig, ax = plt.subplots(figsize=(10, 6))
+    fig, ax = _get_figure((10, 6))
     fig.patch.set_facecolor('#f5f5f5')
     ax.set_facecolor('#ffffff')
 
@@ -435,11 +657,6 @@ def _generate_empty_chart(message: str) -> bytes:
     ax.spines['bottom'].set_visible(False)
     ax.spines['left'].set_visible(False)
 
-    plt.tight_layout()
-
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png', dpi=150, bbox_inches='tight')
-    buf.seek(0)
-    plt.close(fig)
+    fig.tight_layout()
 
-    return buf.getvalue()
\ No newline at end of file
+    return _figure_to_png(fig)
\ No newline at end of file